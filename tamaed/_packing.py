@@ -0,0 +1,57 @@
+"""
+4bpp pixel packing shared by png_to_raw.py and batch_patch_from_csv.py.
+
+Firmware stores two palette indices per byte: first pixel in the low nibble,
+second pixel in the high nibble (an odd pixel count leaves the last high nibble 0).
+"""
+
+import os
+import numpy as np
+
+def _pack4bpp_numpy(idx):
+    if idx.size & 1:  # odd pixel count: pad with a 0 high nibble
+        idx = np.concatenate([idx, np.zeros(1, dtype=np.uint8)])
+    return ((idx[1::2] & 0x0F) << 4) | (idx[0::2] & 0x0F)
+
+def _pack4bpp_loop(idx):
+    n = idx.size
+    out = np.empty((n + 1) // 2, dtype=np.uint8)
+    for i in range(n // 2):
+        out[i] = ((idx[2*i+1] & 0x0F) << 4) | (idx[2*i] & 0x0F)
+    if n & 1:
+        out[-1] = idx[-1] & 0x0F
+    return out
+
+def _compiled_packer():
+    """_pack4bpp_loop compiled with Numba, or None if numba is not installed."""
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.njit(cache=True, boundscheck=False)(_pack4bpp_loop)
+
+def _select_packer():
+    # Importing numba and loading the cached JIT costs ~0.4 s per process and
+    # saves ~13 us per 128x128 image, so it is opt-in only (TAMAED_NUMBA=1).
+    if os.environ.get("TAMAED_NUMBA") == "1":
+        compiled = _compiled_packer()
+        if compiled is not None:
+            return compiled
+    return _pack4bpp_numpy
+
+_pack4bpp = None  # chosen on first pack4bpp() call
+
+def pack4bpp(indices) -> bytes:
+    """Pack palette indices (any array-like, row-major) into 4bpp RAW bytes."""
+    global _pack4bpp
+    if _pack4bpp is None:
+        _pack4bpp = _select_packer()
+    return _pack4bpp(np.ascontiguousarray(indices, dtype=np.uint8).ravel()).tobytes()
+
+def unpack4bpp(raw: bytes, count: int) -> np.ndarray:
+    """Inverse of pack4bpp: the first `count` indices stored in 4bpp RAW bytes."""
+    b = np.frombuffer(raw, dtype=np.uint8)
+    idx = np.empty(b.size * 2, dtype=np.uint8)
+    idx[0::2] = b & 0x0F
+    idx[1::2] = b >> 4
+    return idx[:count]
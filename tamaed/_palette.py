@@ -0,0 +1,56 @@
+"""
+Palette decode tables and matching shared by png_to_raw.py, batch_patch_from_csv.py
+and extractor.py.
+
+Palettes are passed around as their decoded RGB bytes (colors*3, R,G,B order),
+which doubles as the cache key for per-palette setup.
+"""
+
+import functools
+import numpy as np
+
+# 5/6-bit channel -> 8-bit lookup tables
+C5_TO_8 = (np.arange(32) * 255 // 31).astype(np.uint8)
+C6_TO_8 = (np.arange(64) * 255 // 63).astype(np.uint8)
+
+@functools.lru_cache(maxsize=512)
+def _nearest_tables(palette_bytes: bytes):
+    pal = np.frombuffer(palette_bytes, dtype=np.uint8).reshape(-1, 3).astype(np.float32)
+    return pal.T.copy(), (pal * pal).sum(axis=1)
+
+def nearest_indices(pixels, palette_bytes: bytes):
+    """
+    Index of the nearest palette entry (squared RGB distance, lowest index on ties)
+    for each row of an (N, 3) uint8 pixel array.
+    """
+    pal_t, pal_sq = _nearest_tables(palette_bytes)
+    # Search each distinct color once, then scatter back to the pixels
+    key = (pixels[:, 0].astype(np.uint32) << 16) | (pixels[:, 1].astype(np.uint32) << 8) | pixels[:, 2]
+    uniq, inverse = np.unique(key, return_inverse=True)
+    colors = np.stack([uniq >> 16, (uniq >> 8) & 0xFF, uniq & 0xFF], axis=1).astype(np.float32)
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2; |p|^2 is the same for every c so it is dropped.
+    # All terms are integers < 2^24, so float32 is exact here.
+    dist = pal_sq - 2.0 * (colors @ pal_t)
+    return dist.argmin(axis=1).astype(np.uint8)[inverse.ravel()]
+
+def fix_padding_indices(idx, rgb_img, palette_bytes: bytes, colors):
+    """
+    PIL's quantize() can map a pixel to the zero padding past the real palette
+    (index >= colors). Re-match just those pixels exactly; idx is returned unchanged otherwise.
+    """
+    bad = idx >= colors
+    if not bad.any():
+        return idx
+    idx = idx.copy()
+    idx[bad] = nearest_indices(np.asarray(rgb_img).reshape(-1, 3)[bad], palette_bytes)
+    return idx
+
+def indexed_png_indices(img, palette_bytes: bytes, colors):
+    """
+    Index array of a P-mode image that already uses this exact palette
+    (e.g. a re-edited export), else None.
+    """
+    if img.mode != "P" or bytes(img.getpalette()[:colors*3]) != palette_bytes:
+        return None
+    idx = np.asarray(img, dtype=np.uint8).ravel()
+    return idx if idx.max() < colors else None
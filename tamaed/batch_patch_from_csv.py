@@ -7,10 +7,16 @@ python tamaed/batch_patch_from_csv.py \
   --out patched_fw.bin
   """
 
-import argparse, csv, math
-from pathlib import Path
+import argparse, csv, functools, math, os, shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 from PIL import Image
 
+from _packing import pack4bpp
+from _palette import C5_TO_8, C6_TO_8, fix_padding_indices, indexed_png_indices
+
 HEADER_SIZE = 6
 
 def parse_off(s: str) -> int:
@@ -19,97 +25,171 @@ def parse_off(s: str) -> int:
 
 def read_palette(fw: bytes, offset: int, colors: int):
     p0 = offset + HEADER_SIZE
-    p1 = p0 + colors * 2
-    pal = fw[p0:p1]
-    if len(pal) != colors * 2:
+    if p0 < 0 or p0 + colors * 2 > len(fw):
         raise ValueError(f"Palette out of range at 0x{offset:X}")
-    out = []
-    for i in range(0, len(pal), 2):
-        hi, lo = pal[i], pal[i+1]
-        v = (hi << 8) | lo  # big-endian BGR565 (BBBBB GGGGGG RRRRR)
-        b = (v >> 11) & 0x1F
-        g = (v >> 5)  & 0x3F
-        r =  v        & 0x1F
-        out.append(((r*255)//31, (g*255)//63, (b*255)//31))
-    return out
+    v = np.frombuffer(fw, dtype=">u2", count=colors, offset=p0)  # big-endian BGR565 (BBBBB GGGGGG RRRRR)
+    b = (v >> 11) & 0x1F
+    g = (v >> 5)  & 0x3F
+    r =  v        & 0x1F
+    return np.stack([C5_TO_8[r], C6_TO_8[g], C5_TO_8[b]], axis=1)  # (colors, 3) RGB
 
 def make_pal_image(palette_rgb):
     pal_img = Image.new("P", (16, 16))
-    flat = []
-    for r,g,b in palette_rgb: flat += [r,g,b]
-    flat += [0,0,0] * (256 - len(palette_rgb))
+    flat = palette_rgb.tobytes() + bytes(3 * (256 - len(palette_rgb)))
     pal_img.putpalette(flat, rawmode="RGB")
     return pal_img
 
-def png_to_raw_using_fw_palette(png_path, fw, offset, w, h, colors):
-    pal = read_palette(fw, offset, colors)
-    pal_img = make_pal_image(pal)
-    img = Image.open(png_path)
+@functools.lru_cache(maxsize=512)
+def _pal_img_from_bytes(palette_bytes: bytes):
+    # Rows that share a palette (recurring sprites) reuse the same P-mode image
+    return make_pal_image(np.frombuffer(palette_bytes, dtype=np.uint8).reshape(-1, 3))
+
+def png_to_raw_using_fw_palette(png_path, pal_key: bytes, w, h, colors, img=None):
+    if img is None:
+        img = Image.open(png_path)
     if img.size != (w, h):
         raise ValueError(f"{png_path}: size {img.size} != expected {(w,h)}")
-    if img.mode != "RGB":
-        img = img.convert("RGB")
-    q = img.quantize(palette=pal_img, dither=Image.Dither.NONE)
-    idx = list(q.getdata())
-    if max(idx) >= colors:
-        raise ValueError(f"{png_path}: index {max(idx)} >= colors {colors} (used color not in palette)")
+    idx = indexed_png_indices(img, pal_key, colors)
+    if idx is None:  # not already indexed against the firmware palette: quantize
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        q = img.quantize(palette=_pal_img_from_bytes(pal_key), dither=Image.Dither.NONE)
+        idx = fix_padding_indices(np.asarray(q, dtype=np.uint8).ravel(), img, pal_key, colors)
+    if idx.max() >= colors:
+        raise ValueError(f"{png_path}: index {idx.max()} >= colors {colors} (used color not in palette)")
     # pack indices
     if colors <= 16:
-        out = bytearray()
-        it = iter(idx)
-        total = w*h
-        for i in range(0, total//2):
-            a = next(it) & 0x0F  # first pixel -> low nibble
-            b = next(it) & 0x0F  # second pixel -> high nibble
-            out.append((b<<4) | a)
-        if total % 2 == 1:  # odd pixel count (not expected for 128x128)
-            a = next(it) & 0x0F
-            out.append(a)
-        return bytes(out)
+        return pack4bpp(idx)
     else:
-        return bytes(idx)
+        return idx.tobytes()
+
+_worker_shm = None  # keeps the worker's attachment to the shared firmware alive
+_worker_fw = None   # read-only uint8 view of the input firmware, one per pool worker
+
+def _init_worker(shm_name, fw_len):
+    global _worker_shm, _worker_fw
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_fw = np.ndarray((fw_len,), dtype=np.uint8, buffer=_worker_shm.buf)
+    _worker_fw.flags.writeable = False
+    _worker_palette.cache_clear()
+
+@functools.lru_cache(maxsize=1024)
+def _worker_palette(offset, colors):
+    # A worker only ever sees one firmware, so (offset, colors) identifies a palette;
+    # rows sharing a sprite-sheet palette decode it once.
+    return read_palette(_worker_fw, offset, colors).tobytes()
+
+def share_firmware(fw_path):
+    """Load the input firmware once into a shared memory block that pool workers attach to."""
+    fw_len = os.path.getsize(fw_path)
+    if fw_len == 0:
+        raise SystemExit(f"Firmware is empty: {fw_path}")
+    shm = shared_memory.SharedMemory(create=True, size=fw_len)
+    with open(fw_path, "rb") as f, shm.buf[:fw_len] as view:
+        f.readinto(view)
+    return shm, fw_len
+
+def load_png(row):
+    """Runs in a prefetch thread: open and fully decode one row's PNG."""
+    img = Image.open(row["png"].strip())
+    img.load()
+    return img
+
+def prefetch(fn, items, depth):
+    """Yield (item, future of fn(item)) in order, keeping up to `depth` calls running ahead in threads."""
+    with ThreadPoolExecutor(max_workers=depth) as ex:
+        pending = deque()
+        for item in items:
+            pending.append((item, ex.submit(fn, item)))
+            if len(pending) >= depth:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
 
-def patch_one(fw_ba, offset, colors, w, h, raw_bytes):
+def process_row(row, img):
+    """Runs in a pool worker: parse one CSV row and convert its decoded PNG to RAW pixel bytes."""
+    off   = parse_off(row["offset"])
+    w     = int(row["width"])
+    h     = int(row["height"])
+    colors= int(row["colors"])
+    png   = row["png"].strip()
+    name  = row.get("name", "").strip() or png
+
+    raw = png_to_raw_using_fw_palette(png, _worker_palette(off, colors), w, h, colors, img)
+    return name, off, w, h, colors, raw
+
+def patch_one(out_f, fw_len, offset, colors, w, h, raw_bytes):
     pixel_start = offset + HEADER_SIZE + colors*2
     expected = (math.ceil(w*h/2) if colors <= 16 else w*h)
     if len(raw_bytes) != expected:
         raise ValueError(f"RAW length {len(raw_bytes)} != expected {expected}")
-    fw_ba[pixel_start : pixel_start + expected] = raw_bytes
+    if pixel_start + expected > fw_len:
+        raise ValueError(f"Pixel data out of range at 0x{offset:X}")
+    out_f.seek(pixel_start)
+    out_f.write(raw_bytes)
     return pixel_start, expected
 
+def positive_int(s: str) -> int:
+    n = int(s)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be >= 1, got {n}")
+    return n
+
+def load_rows(csv_path):
+    """CSV rows as dicts of strings."""
+    with open(csv_path, newline="") as f:
+        return list(csv.DictReader(f))
+
 def main():
     ap = argparse.ArgumentParser(description="Batch patch edited PNGs into Tama firmware from a CSV.")
     ap.add_argument("--firmware", required=True, help="Input firmware .bin")
     ap.add_argument("--csv", required=True, help="CSV file (offset,width,height,colors,png[,name])")
     ap.add_argument("--out", default="patched_fw.bin", help="Output firmware filename")
+    ap.add_argument("--jobs", type=positive_int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
     args = ap.parse_args()
 
-    fw_path = Path(args.firmware)
-    fw = bytearray(fw_path.read_bytes())
-
-    rows = list(csv.DictReader(Path(args.csv).open(newline="")))
+    rows = load_rows(args.csv)
     if not rows:
         raise SystemExit("No rows found in CSV.")
 
-    print(f"Patching {len(rows)} item(s) into {args.out} ...")
-    patched = 0
-    for i, row in enumerate(rows, 1):
+    # Snapshot the input for the workers before anything is written,
+    # so patching in place cannot change the palettes they read.
+    shm, fw_len = share_firmware(args.firmware)
+    try:
+        # Start from a copy of the input and only rewrite the patched ranges
         try:
-            off   = parse_off(row["offset"])
-            w     = int(row["width"])
-            h     = int(row["height"])
-            colors= int(row["colors"])
-            png   = row["png"].strip()
-            name  = row.get("name", "").strip() or png
-
-            raw = png_to_raw_using_fw_palette(png, fw, off, w, h, colors)
-            start, count = patch_one(fw, off, colors, w, h, raw)
-            print(f"  [{i}/{len(rows)}] {name}: wrote {count} bytes at 0x{start:X}")
-            patched += 1
-        except Exception as e:
-            print(f"  [{i}/{len(rows)}] ERROR: {e}")
-
-    Path(args.out).write_bytes(fw)
+            shutil.copyfile(args.firmware, args.out)
+        except shutil.SameFileError:
+            pass  # patching in place
+
+        # Rows are independent: threads read and decode PNGs ahead of the
+        # pool, workers convert them against the shared firmware and return
+        # RAW bytes; patches are applied here, in CSV order.
+        print(f"Patching {len(rows)} item(s) into {args.out} ...")
+        patched = 0
+        with open(args.out, "r+b") as out_f, \
+             ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                 initargs=(shm.name, fw_len)) as pool:
+            jobs = []  # (pool future, None) or (None, PNG load error), in CSV order
+            for row, loaded in prefetch(load_png, rows, 2 * args.jobs):
+                try:
+                    jobs.append((pool.submit(process_row, row, loaded.result()), None))
+                except Exception as e:
+                    jobs.append((None, e))
+            for i, (fut, load_error) in enumerate(jobs, 1):
+                try:
+                    if load_error is not None:
+                        raise load_error
+                    name, off, w, h, colors, raw = fut.result()
+                    start, count = patch_one(out_f, fw_len, off, colors, w, h, raw)
+                    print(f"  [{i}/{len(rows)}] {name}: wrote {count} bytes at 0x{start:X}")
+                    patched += 1
+                except Exception as e:
+                    print(f"  [{i}/{len(rows)}] ERROR: {e}")
+    finally:
+        shm.close()
+        shm.unlink()
+
     print(f"Done. Patched {patched}/{len(rows)} images → {args.out}")
 
 if __name__ == "__main__":
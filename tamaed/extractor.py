@@ -1,35 +1,53 @@
-import json, os, numpy as np
+import argparse, json, os, numpy as np
 from PIL import Image
 
-BIN_PATH = "fw_tama.bin"
-META_PATH = "tama_image_map.json"
-OUT_DIR = "extracted"
-
-os.makedirs(OUT_DIR, exist_ok=True)
-
-with open(BIN_PATH, "rb") as f:
-    firmware = f.read()
-
-with open(META_PATH, "r") as f:
-    entities = json.load(f)
-
-for ent in entities:
-    offset = int(ent["offset"])
-    size = int(ent["size"])
-    width, height = ent["width"], ent["height"]
-    raw = firmware[offset : offset + size]
-
-    # Skip tiny blocks that aren't images
-    if width * height < 64:
-        continue
-
-    data = np.frombuffer(raw, dtype=np.uint16)
-    if data.size != width * height:
-        continue
-    r = ((data >> 11) & 0x1F) * 255 // 31
-    g = ((data >> 5) & 0x3F) * 255 // 63
-    b = (data & 0x1F) * 255 // 31
-    img = np.dstack((r, g, b)).astype(np.uint8)
-
-    Image.fromarray(img, "RGB").save(f"{OUT_DIR}/img_{offset:06X}.png")
-    print(f"Exported {offset:06X} ({width}x{height})")
\ No newline at end of file
+from _palette import C5_TO_8, C6_TO_8
+
+_entities_cache = {}  # path -> (mtime_ns, parsed entities)
+
+def load_entities(meta_path):
+    """Parse the image map JSON, reusing the previous parse while the file is unchanged."""
+    mtime = os.stat(meta_path).st_mtime_ns
+    cached = _entities_cache.get(meta_path)
+    if cached is None or cached[0] != mtime:
+        with open(meta_path, "r") as f:
+            cached = _entities_cache[meta_path] = (mtime, json.load(f))
+    return cached[1]
+
+def extract_all(firmware, entities, out_dir):
+    """Decode every RGB565 image block listed in `entities` to out_dir/img_<OFFSET>.png."""
+    os.makedirs(out_dir, exist_ok=True)
+    for ent in entities:
+        offset = int(ent["offset"])
+        size = int(ent["size"])
+        width, height = ent["width"], ent["height"]
+        raw = firmware[offset : offset + size]
+
+        # Skip tiny blocks that aren't images
+        if width * height < 64:
+            continue
+
+        data = np.frombuffer(raw, dtype="<u2")  # little-endian, as written by instert_images.py
+        if data.size != width * height:
+            continue
+        data = data.reshape(height, width)
+
+        # Decode straight into one (H,W,3) buffer, one LUT gather per channel
+        img = np.empty((height, width, 3), dtype=np.uint8)
+        np.take(C5_TO_8, (data >> 11) & 0x1F, out=img[:, :, 0], mode="clip")
+        np.take(C6_TO_8, (data >> 5) & 0x3F, out=img[:, :, 1], mode="clip")
+        np.take(C5_TO_8, data & 0x1F, out=img[:, :, 2], mode="clip")
+
+        Image.fromarray(img, "RGB").save(f"{out_dir}/img_{offset:06X}.png")
+        print(f"Exported {offset:06X} ({width}x{height})")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Export RGB565 firmware images listed in an image map JSON.")
+    ap.add_argument("--firmware", default="fw_tama.bin", help="Firmware .bin")
+    ap.add_argument("--meta", default="tama_image_map.json", help="Image map JSON")
+    ap.add_argument("--out-dir", default="extracted", help="Directory for exported PNGs")
+    args = ap.parse_args()
+
+    with open(args.firmware, "rb") as f:
+        firmware = f.read()
+    extract_all(firmware, load_entities(args.meta), args.out_dir)
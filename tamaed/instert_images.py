@@ -1,35 +1,57 @@
-import json, os, numpy as np
+import argparse, os, numpy as np
 from PIL import Image
 
-BIN_PATH = "fw_tama.bin"
-META_PATH = "tama_image_map.json"
-IN_DIR = "extracted"
-OUT_PATH = "fw_tama_patched.bin"
-
-with open(BIN_PATH, "rb") as f:
-    firmware = bytearray(f.read())
-
-with open(META_PATH, "r") as f:
-    entities = json.load(f)
-
-for ent in entities:
-    offset = int(ent["offset"])
-    width, height = ent["width"], ent["height"]
-    png_path = f"{IN_DIR}/img_{offset:06X}.png"
-    if not os.path.exists(png_path):
-        continue
-
-    img = Image.open(png_path).convert("RGB").resize((width, height))
-    arr = np.array(img, dtype=np.uint8)
-    r = arr[:,:,0].astype(np.uint16)
-    g = arr[:,:,1].astype(np.uint16)
-    b = arr[:,:,2].astype(np.uint16)
-    data = ((r * 31 // 255) << 11) | ((g * 63 // 255) << 5) | (b * 31 // 255)
-    raw = data.astype('<u2').tobytes()
-
-    firmware[offset : offset + len(raw)] = raw
-    print(f"Replaced {offset:06X} ({width}x{height})")
-
-with open(OUT_PATH, "wb") as f:
-    f.write(firmware)
-print("All images inserted.")
\ No newline at end of file
+from extractor import load_entities
+
+def encode_rgb565(arr, out, tmp):
+    """Encode an (H,W,3) uint8 RGB array into the (H,W) uint16 `out`, using `tmp` as scratch.
+
+    x*31//255 == (x*249)>>11 and x*63//255 == (x*253)>>10 for every uint8 x,
+    so each channel is one multiply and one shift/mask with no division.
+    """
+    np.multiply(arr[:,:,0], 249, out=out, dtype=np.uint16)
+    np.bitwise_and(out, 0xF800, out=out)                    # R: ((r*249)>>11)<<11
+    np.multiply(arr[:,:,1], 253, out=tmp, dtype=np.uint16)
+    np.right_shift(tmp, 5, out=tmp)
+    np.bitwise_and(tmp, 0x07E0, out=tmp)                    # G: ((g*253)>>10)<<5
+    np.bitwise_or(out, tmp, out=out)
+    np.multiply(arr[:,:,2], 249, out=tmp, dtype=np.uint16)
+    np.right_shift(tmp, 11, out=tmp)                        # B: (b*249)>>11
+    np.bitwise_or(out, tmp, out=out)
+    return out
+
+def insert_all(firmware, entities, in_dir):
+    """Encode in_dir/img_<OFFSET>.png back over each listed block of the `firmware` bytearray."""
+    buffers = {}  # (height, width) -> (out, tmp), reused across same-sized images
+    for ent in entities:
+        offset = int(ent["offset"])
+        width, height = ent["width"], ent["height"]
+        png_path = f"{in_dir}/img_{offset:06X}.png"
+        if not os.path.exists(png_path):
+            continue
+
+        img = Image.open(png_path).convert("RGB").resize((width, height))
+        arr = np.asarray(img, dtype=np.uint8)
+        if (height, width) not in buffers:
+            buffers[(height, width)] = (np.empty((height, width), np.uint16), np.empty((height, width), np.uint16))
+        data = encode_rgb565(arr, *buffers[(height, width)])
+        raw = data.astype('<u2', copy=False).tobytes()
+
+        firmware[offset : offset + len(raw)] = raw
+        print(f"Replaced {offset:06X} ({width}x{height})")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Insert edited PNGs back into RGB565 firmware image blocks.")
+    ap.add_argument("--firmware", default="fw_tama.bin", help="Firmware .bin")
+    ap.add_argument("--meta", default="tama_image_map.json", help="Image map JSON")
+    ap.add_argument("--in-dir", default="extracted", help="Directory with img_<OFFSET>.png files")
+    ap.add_argument("--out", default="fw_tama_patched.bin", help="Output firmware filename")
+    args = ap.parse_args()
+
+    with open(args.firmware, "rb") as f:
+        firmware = bytearray(f.read())
+    insert_all(firmware, load_entities(args.meta), args.in_dir)
+
+    with open(args.out, "wb") as f:
+        f.write(firmware)
+    print("All images inserted.")
@@ -7,7 +7,7 @@ python tamaed/patch_raw_into_firmware.py \
   --raw images/builds/img_45c040.raw \
   --out patched_fw.bin
 """
-import argparse, math
+import argparse, math, os, shutil
 from pathlib import Path
 
 def main():
@@ -24,7 +24,6 @@ def main():
     # Parse hex or decimal offset
     off = int(args.offset, 16) if args.offset.lower().startswith("0x") else int(args.offset)
 
-    fw = bytearray(Path(args.firmware).read_bytes())
     raw = Path(args.raw).read_bytes()
 
     # Calculate where pixel data actually begins
@@ -33,10 +32,18 @@ def main():
 
     if len(raw) != data_len:
         print(f"⚠️ RAW length {len(raw)} ≠ expected {data_len}; double-check palette size / dimensions.")
-    data_end = data_start + data_len
+    data_end = data_start + len(raw)
+    if data_end > os.path.getsize(args.firmware):
+        raise SystemExit(f"Pixel data 0x{data_start:X}..0x{data_end:X} runs past the end of the firmware.")
 
-    fw[data_start:data_end] = raw
-    Path(args.out).write_bytes(fw)
+    # Copy the firmware once, then overwrite only the pixel range
+    try:
+        shutil.copyfile(args.firmware, args.out)
+    except shutil.SameFileError:
+        pass  # patching in place
+    with open(args.out, "r+b") as f:
+        f.seek(data_start)
+        f.write(raw)
     print(f"Patched {len(raw)} bytes at offset 0x{data_start:X} → {args.out}")
 
 if __name__ == "__main__":
@@ -10,8 +10,12 @@ python tamaed/png_to_tama_raw.py \
 
 import argparse, sys, struct, math
 from pathlib import Path
+import numpy as np
 from PIL import Image
 
+from _packing import pack4bpp
+from _palette import C5_TO_8, C6_TO_8, fix_padding_indices, indexed_png_indices
+
 def read_palette_from_firmware(fw_bytes: bytes, offset: int, colors_count: int):
     """
     Palette bytes are stored right after a 6-byte header.
@@ -20,46 +24,41 @@ def read_palette_from_firmware(fw_bytes: bytes, offset: int, colors_count: int):
     header_size = 6
     pal_off = offset + header_size
     pal_len = colors_count * 2
-    pal_bytes = fw_bytes[pal_off : pal_off + pal_len]
-    if len(pal_bytes) != pal_len:
+    if pal_off < 0 or pal_off + pal_len > len(fw_bytes):
         raise ValueError("Firmware too short to contain the palette at given offset/size.")
 
-    palette_rgb = []
-    for i in range(0, len(pal_bytes), 2):
-        hi = pal_bytes[i]
-        lo = pal_bytes[i + 1]
-        color16 = (hi << 8) | lo  # big-endian
+    # One big-endian load for the whole palette
+    color16 = np.frombuffer(fw_bytes, dtype=">u2", count=colors_count, offset=pal_off)
 
-        # Decode BGR565 (MSB..LSB: BBBBB GGGGGG RRRRR)
-        blue  = (color16 >> 11) & 0x1F
-        green = (color16 >> 5)  & 0x3F
-        red   =  color16        & 0x1F
+    # Decode BGR565 (MSB..LSB: BBBBB GGGGGG RRRRR)
+    blue  = (color16 >> 11) & 0x1F
+    green = (color16 >> 5)  & 0x3F
+    red   =  color16        & 0x1F
 
-        # Scale to 0..255
-        r8 = (red   * 255) // 31
-        g8 = (green * 255) // 63
-        b8 = (blue  * 255) // 31
-        palette_rgb.append((r8, g8, b8))
+    # Scale to 0..255
+    r8 = C5_TO_8[red]
+    g8 = C6_TO_8[green]
+    b8 = C5_TO_8[blue]
 
-    return palette_rgb  # list of (R,G,B), length = colors_count
+    return np.stack([r8, g8, b8], axis=1)  # (colors_count, 3) array of R,G,B
 
 def make_palette_image(palette_rgb):
     """Build a tiny P-mode image with the exact palette for use in PIL.quantize()."""
     pal_img = Image.new("P", (16, 16))
-    # PIL wants a palette list of length 768 (256*3). Pad with zeros beyond our palette.
-    flat = []
-    for (r, g, b) in palette_rgb:
-        flat.extend([r, g, b])
-    # pad to 256*3
-    flat.extend([0, 0, 0] * (256 - len(palette_rgb)))
+    # PIL wants a palette of length 768 (256*3). Pad with zeros beyond our palette.
+    flat = palette_rgb.tobytes() + bytes(3 * (256 - len(palette_rgb)))
     pal_img.putpalette(flat, rawmode="RGB")
     return pal_img
 
-def quantize_to_palette(img: Image.Image, pal_img: Image.Image):
+def quantize_to_palette(img: Image.Image, palette_rgb):
     """
     Quantize the edited image to the exact firmware palette.
     Dither off to keep indexes stable.
     """
+    # Already indexed against this exact palette (e.g. a re-edited export): keep the indices
+    if indexed_png_indices(img, palette_rgb.tobytes(), len(palette_rgb)) is not None:
+        return img
+
     # Ensure no alpha during quantization
     if img.mode in ("RGBA", "LA"):
         img = img.convert("RGB")
@@ -67,8 +66,15 @@ def quantize_to_palette(img: Image.Image, pal_img: Image.Image):
         img = img.convert("RGB")
 
     # Use the fixed palette
+    pal_img = make_palette_image(palette_rgb)
     quant = img.quantize(palette=pal_img, dither=Image.Dither.NONE)
-    return quant  # mode "P", palette equals pal_img
+
+    # Pixels PIL sent to the zero padding past the palette get their exact nearest entry
+    idx = np.asarray(quant, dtype=np.uint8).ravel()
+    fixed = fix_padding_indices(idx, img, palette_rgb.tobytes(), len(palette_rgb))
+    if fixed is not idx:
+        quant = Image.fromarray(fixed.reshape(img.height, img.width), "P")
+    return quant  # mode "P"
 
 def pack_indices_to_raw(indices, width, height, colors_count):
     """
@@ -80,27 +86,10 @@ def pack_indices_to_raw(indices, width, height, colors_count):
     """
     if colors_count <= 16:
         # 4bpp
-        out = bytearray()
-        # Walk in raster order; pack two at a time
-        it = iter(indices)
-        try:
-            while True:
-                a = next(it)
-                b = next(it)
-                byte = (b << 4) | (a & 0x0F)  # low nibble first: a in low, b in high
-                out.append(byte)
-        except StopIteration:
-            # If odd number of pixels, pad the last high nibble with 0
-            total = width * height
-            if total % 2 == 1:
-                # last 'a' has been processed but no 'b'
-                # reconstruct last 'a':
-                last_a = indices[-1] & 0x0F
-                out.append(last_a)  # high nibble zeroed automatically
-        return bytes(out)
+        return pack4bpp(indices)
     else:
         # 8bpp
-        return bytes(indices)
+        return np.asarray(indices, dtype=np.uint8).tobytes()
 
 def main():
     p = argparse.ArgumentParser(description="Convert edited PNG to Tama RAW pixel data using firmware palette.")
@@ -131,13 +120,12 @@ def main():
         sys.exit(f"ERROR: PNG size {img.width}x{img.height} does not match expected {args.width}x{args.height}")
 
     # 3) Quantize edited PNG to the exact firmware palette
-    pal_img = make_palette_image(palette_rgb)
-    pal_quant = quantize_to_palette(img, pal_img)
+    pal_quant = quantize_to_palette(img, palette_rgb)
 
-    # 4) Extract indices (row-major)
-    idx = list(pal_quant.getdata())
+    # 4) Extract indices (row-major), straight from PIL's buffer
+    idx = np.asarray(pal_quant, dtype=np.uint8).ravel()
     # Sanity-check indices are within palette range
-    max_idx = max(idx) if idx else 0
+    max_idx = int(idx.max()) if idx.size else 0
     if max_idx >= args.colors:
         sys.exit(f"ERROR: Quantized image used index {max_idx}, but palette has only {args.colors} colors. "
                  "Check that you stayed within color limits.")
@@ -27,6 +27,7 @@ Usage:
 import csv, math, sys
 from pathlib import Path
 import argparse
+import numpy as np
 
 MAGIC_B5 = 0x00
 MAGIC_B6 = 0x01
@@ -39,20 +40,22 @@ def parse_offset(val: str) -> int:
         return int(s, 16)
     return int(s, 10)
 
-def read_image_header(fw: bytes, off: int):
+def read_image_headers(fw: bytes, offs):
     """
-    Returns (width, height, colors, ok_magic) or raises if out of range.
+    Reads the 6-byte headers at all offsets in one fancy-index gather.
+    Returns (in_range, widths, heights, colors, ok_magic) arrays, one entry per offset;
+    entries with in_range False have zero sizes and ok_magic False.
     """
-    if off < 0 or off + 6 > len(fw):
-        raise ValueError(f"Offset out of range: 0x{off:X}")
-    w = fw[off + 0]
-    h = fw[off + 1]
-    colors = fw[off + 2]
-    b5 = fw[off + 3]
-    b6 = fw[off + 4]
-    b7 = fw[off + 5]
-    ok_magic = (b5 == MAGIC_B5 and b6 == MAGIC_B6 and b7 == MAGIC_B7)
-    return (w, h, colors, ok_magic)
+    fw_arr = np.frombuffer(fw, dtype=np.uint8)
+    offs = np.asarray(offs, dtype=np.int64)
+    in_range = (offs >= 0) & (offs + HEADER_FIXED <= len(fw_arr))
+    headers = np.zeros((len(offs), HEADER_FIXED), dtype=np.uint8)
+    headers[in_range] = fw_arr[offs[in_range, None] + np.arange(HEADER_FIXED)]
+    ok_magic = (in_range
+                & (headers[:, 3] == MAGIC_B5)
+                & (headers[:, 4] == MAGIC_B6)
+                & (headers[:, 5] == MAGIC_B7))
+    return in_range, headers[:, 0], headers[:, 1], headers[:, 2], ok_magic
 
 def calc_sizes(w: int, h: int, colors: int):
     header_size = HEADER_FIXED + colors * 2
@@ -137,20 +140,28 @@ def main():
     out_rows = []
     missing = []
 
+    # Parse every offset first, then read all headers in one go
+    data_rows = [r for r in data_rows if r]
+    offsets = []
     for r in data_rows:
-        if not r:
-            continue
         try:
-            off = parse_offset(r[0])
-        except Exception as e:
+            offsets.append(parse_offset(r[0]))
+        except Exception:
+            offsets.append(None)
+    parsed = [off for off in offsets if off is not None]
+    # offsets past the end (including ones too large for int64) become -1 = out of range
+    in_range, widths, heights, colors_arr, magic = read_image_headers(
+        fw, [off if 0 <= off < len(fw) else -1 for off in parsed])
+
+    k = -1
+    for r, off in zip(data_rows, offsets):
+        if off is None:
             # keep row, but mark as invalid
             out_rows.append(r + ["", "", "", "", "", "false", "", "", "", "false", ""])
             continue
+        k += 1
 
-        # Read header from firmware
-        try:
-            w, h, colors, ok_magic = read_image_header(fw, off)
-        except Exception as e:
+        if not in_range[k]:
             # out of range; still emit a row with minimal info
             out_rows.append(r + [
                 f"0x{off:X}".lower(), off,
@@ -159,6 +170,8 @@ def main():
             ])
             continue
 
+        w, h, colors = int(widths[k]), int(heights[k]), int(colors_arr[k])
+        ok_magic = bool(magic[k])
         header_size, data_len, block_size = calc_sizes(w, h, colors)
         data_start = off + header_size
         exists, path = find_edited_raw(edited_dir, off)
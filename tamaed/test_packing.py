@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import _packing
+from _packing import pack4bpp, unpack4bpp
+
+SIZES = [0, 1, 2, 7, 135, 128 * 128]
+
+@pytest.mark.parametrize("n", SIZES)
+def test_round_trip(n):
+    a = np.random.default_rng(n).integers(0, 16, n, dtype=np.uint8)
+    raw = pack4bpp(a)
+    assert len(raw) == (n + 1) // 2
+    assert (unpack4bpp(raw, n) == a).all()
+
+@pytest.mark.parametrize("n", SIZES)
+def test_numpy_and_loop_packers_agree(n):
+    a = np.random.default_rng(n).integers(0, 16, n, dtype=np.uint8)
+    expected = _packing._pack4bpp_numpy(a).tobytes()
+    assert _packing._pack4bpp_loop(a).tobytes() == expected
+    assert (unpack4bpp(expected, n) == a).all()
+
+_compiled = _packing._compiled_packer()
+
+@pytest.mark.skipif(_compiled is None, reason="numba not installed")
+@pytest.mark.parametrize("n", SIZES)
+def test_compiled_packer_round_trip(n):
+    a = np.random.default_rng(n).integers(0, 16, n, dtype=np.uint8)
+    raw = _compiled(a).tobytes()
+    assert raw == _packing._pack4bpp_numpy(a).tobytes()
+    assert (unpack4bpp(raw, n) == a).all()
+
+def test_numpy_packer_is_default(monkeypatch):
+    monkeypatch.delenv("TAMAED_NUMBA", raising=False)
+    assert _packing._select_packer() is _packing._pack4bpp_numpy
+
+def test_low_nibble_is_first_pixel():
+    assert pack4bpp([1, 2, 3]) == bytes([0x21, 0x03])